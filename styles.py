@@ -0,0 +1,15 @@
+import streamlit as st
+
+STYLE_PATH = 'style.css'
+
+
+@st.cache_data
+def get_css():
+    """
+    读取页面CSS并包上<style>标签。
+
+    被@st.cache_data缓存后磁盘只读一次，滑块等交互触发的rerun
+    直接复用缓存的字符串。
+    """
+    with open(STYLE_PATH, encoding='utf-8') as f:
+        return f"<style>{f.read()}</style>"